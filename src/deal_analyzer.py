@@ -4,6 +4,7 @@ import datetime
 import logging
 import pandas as pd
 import re
+import time
 from typing import List, Dict, Any, Optional
 from pathlib import Path
 
@@ -62,6 +63,127 @@ class Manifest:
         self.data["current_asin"] = None
         self.save()
 
+class RetryQueue:
+    """Persistent queue of ASINs whose Keepa lookup failed, retried with exponential backoff."""
+
+    def __init__(self, output_dir: str, max_retries: int = 3, base_delay: float = 30.0, max_delay: float = 600.0):
+        self.path = Path(output_dir) / 'retry_queue.json'
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.entries: dict[str, dict] = {}  # "file::tab::asin" -> entry
+
+    @staticmethod
+    def key(input_file: str, tab: str, asin: str) -> str:
+        return f"{input_file}::{tab}::{asin}"
+
+    def load(self) -> bool:
+        if self.path.exists():
+            try:
+                with self.path.open('r') as f:
+                    self.entries = json.load(f)
+                return True
+            except Exception as e:
+                logger.error(f"Failed to load retry queue: {e}")
+        return False
+
+    def save(self):
+        temp_path = self.path.with_suffix('.json.tmp')
+        try:
+            with temp_path.open('w') as f:
+                json.dump(self.entries, f, indent=4)
+            temp_path.replace(self.path)
+        except Exception as e:
+            logger.error(f"Failed to save retry queue: {e}")
+
+    def backoff(self, attempts: int) -> float:
+        return min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+
+    def record_failure(self, input_file: str, tab: str, asin: str, error: str, error_kind: str,
+                       now: float | None = None):
+        now = time.time() if now is None else now
+        # Excel may read ASINs (e.g. ISBN-10s) as numbers, which json cannot serialize
+        asin = str(asin)
+        key = self.key(str(input_file), tab, asin)
+        entry = self.entries.get(key) or {
+            "input_file": str(input_file),
+            "tab": tab,
+            "asin": asin,
+            "attempts": 0,
+        }
+        entry["attempts"] += 1
+        entry["last_error"] = error
+        entry["error_kind"] = error_kind
+        if error_kind == 'invalid' or entry["attempts"] > self.max_retries:
+            # Dead letter: kept for reporting, never retried
+            entry["status"] = "dead"
+            entry["next_attempt_time"] = None
+        else:
+            entry["status"] = "pending"
+            entry["next_attempt_time"] = now + self.backoff(entry["attempts"])
+        self.entries[key] = entry
+        self.save()
+
+    def dead_letter(self, input_file: str, tab: str, asin: str, error: str, error_kind: str):
+        entry = self.entries.get(self.key(str(input_file), tab, str(asin)))
+        if entry is None:
+            return
+        entry["last_error"] = error
+        entry["error_kind"] = error_kind
+        entry["status"] = "dead"
+        entry["next_attempt_time"] = None
+        self.save()
+
+    def resolve(self, input_file: str, tab: str, asin: str):
+        if self.entries.pop(self.key(str(input_file), tab, str(asin)), None) is not None:
+            self.save()
+
+    def pending(self) -> list[dict]:
+        entries = [e for e in self.entries.values() if e["status"] == "pending"]
+        return sorted(entries, key=lambda e: e["next_attempt_time"])
+
+    def dead_letters(self) -> list[dict]:
+        return [e for e in self.entries.values() if e["status"] == "dead"]
+
+class StagedTab:
+    """Rows of one input tab and the enriched records staged for it so far.
+
+    Staged records carry their original sheet row in `source_row`, so resuming does not
+    depend on the order rows were processed in.
+    """
+
+    def __init__(self, file_path: Path, tab: str, sheet_df: pd.DataFrame, staging_csv: Path):
+        self.file_path = Path(file_path)
+        self.tab = tab
+        self.sheet_df = sheet_df
+        self.staging_csv = staging_csv
+        self.records: list[dict] = []
+        self.dirty = False
+
+        if staging_csv.exists():
+            staged_df = pd.read_csv(staging_csv)
+            if 'source_row' in staged_df.columns:
+                self.records = staged_df.to_dict('records')
+            else:
+                logger.warning(f"Staged data for {tab} has no source_row column; re-processing the tab.")
+        done = {int(r['source_row']) for r in self.records}
+        self.remaining: set = set(sheet_df.index) - done
+
+    @property
+    def complete(self) -> bool:
+        return not self.remaining
+
+    def add(self, idx: Any, record: dict):
+        record['source_row'] = idx
+        self.records.append(record)
+        self.remaining.discard(idx)
+        self.dirty = True
+
+    def save(self):
+        if self.records:
+            pd.DataFrame(self.records).to_csv(self.staging_csv, index=False)
+        self.dirty = False
+
 class DealAnalyzer:
     def __init__(self, arg_dict: dict):
         self.arg_dict: dict = arg_dict
@@ -70,6 +192,13 @@ class DealAnalyzer:
         self.tab_regex: str = arg_dict['tab_regex']
         self.input_files: list[Path] = [Path(p) for p in arg_dict['input_file_list']]
         self.keepa_client: KeepaAPI = arg_dict['keepa_client']
+        self.priority_order: str = arg_dict.get('priority_order', 'asin')
+        self.priority_value_cols: list[str] = arg_dict.get('priority_value_cols', ['EXT MSRP', 'Quantity'])
+        self.provisional_interval: float = arg_dict.get('provisional_report_minutes', 0) * 60
+        self.last_provisional_time: float = time.time()
+        self.sheet_order: dict[str, list[str]] = {}  # file_path -> matching tabs in workbook order
+        if self.priority_order not in ('asin', 'value'):
+            raise ValueError(f"Unknown priority_order {self.priority_order!r}; expected 'asin' or 'value'.")
         
         self.staging_dir.mkdir(parents=True, exist_ok=True)
         config_logger(arg_dict['output_dir'], arg_dict['log_name'], logger)
@@ -81,79 +210,221 @@ class DealAnalyzer:
             self.manifest.data["input_files"] = [str(p) for p in self.input_files]
             self.manifest.save()
 
+        self.retry_queue: RetryQueue = RetryQueue(str(self.output_dir),
+                                                  max_retries=arg_dict.get('max_retries', 3),
+                                                  base_delay=arg_dict.get('retry_base_delay', 30.0),
+                                                  max_delay=arg_dict.get('retry_max_delay', 600.0))
+        if self.retry_queue.load():
+            logger.info(f"Loaded retry queue with {len(self.retry_queue.pending())} pending ASINs.")
+
     def run(self):
+        stages = self.load_stages()
+        work = self.prioritize(stages)
+        if work:
+            logger.info(f"Enriching {len(work)} rows across {len(stages)} tabs "
+                        f"(priority order: {self.priority_order}).")
+
+        for i, (stage, idx) in enumerate(work, start=1):
+            self.process_row(stage, idx)
+            if stage.complete:
+                self.complete_stage(stage)
+            elif i % 10 == 0:
+                # Periodic checkpoint
+                self.checkpoint(stages)
+            if self.provisional_interval and time.time() - self.last_provisional_time >= self.provisional_interval:
+                self.write_provisional_report(stages)
+
+        self.retry_failed()
+        self.finalize()
+
+    def load_stages(self) -> list[StagedTab]:
+        stages = []
         for file_path in self.input_files:
-            # Skip completed files if all tabs are done
-            
             excel = pd.ExcelFile(file_path)
             all_tabs = [t for t in excel.sheet_names if re.match(self.tab_regex, t)]
-            
+            self.sheet_order[str(file_path)] = all_tabs
+
             completed_in_file = self.manifest.data["completed_tabs"].get(str(file_path), [])
-            
+
             for tab in all_tabs:
                 if tab in completed_in_file:
                     logger.info(f"Tab {tab} already completed for {file_path}. Skipping.")
                     continue
-                
-                self.process_tab(file_path, tab, excel)
-                self.manifest.mark_tab_complete(str(file_path), tab)
 
-        self.finalize()
+                stage = StagedTab(file_path, tab, excel.parse(tab), self._staging_csv(file_path, tab))
+                if stage.records:
+                    logger.info(f"Resuming {tab} in {file_path.name}: {len(stage.records)} rows staged, "
+                                f"{len(stage.remaining)} remaining.")
+                if stage.complete:
+                    self.complete_stage(stage)
+                    continue
+                stages.append(stage)
+        return stages
 
-    def process_tab(self, file_path: Path, tab: str, excel_obj: pd.ExcelFile):
-        logger.info(f"Processing Tab: {tab} in {file_path.name}")
-        
-        # Set initial context in manifest
-        self.manifest.data["current_input_file"] = str(file_path)
-        self.manifest.data["current_tab"] = tab
-        self.manifest.save()
+    def row_values(self, sheet_df: pd.DataFrame) -> pd.Series:
+        # Product of the priority columns, e.g. EXT MSRP x Quantity; missing or non-numeric values rank last
+        values = pd.Series(1.0, index=sheet_df.index)
+        for col in self.priority_value_cols:
+            if col not in sheet_df.columns:
+                logger.warning(f"Priority column {col} not found; ranking its rows last.")
+                return pd.Series(0.0, index=sheet_df.index)
+            values *= pd.to_numeric(sheet_df[col], errors='coerce').fillna(0)
+        return values
 
-        sheet_df = excel_obj.parse(tab).sort_values('B00 ASIN')
-        staging_csv = self.staging_dir / f"{file_path.name}_{tab}.csv"
-        
-        results = []
-        # Resume within tab
-        if self.manifest.data["current_tab"] == tab and self.manifest.data["current_input_file"] == str(file_path):
+    def prioritize(self, stages: list[StagedTab]) -> list[tuple[StagedTab, Any]]:
+        if self.priority_order == 'asin':
+            # File order, then tab order, then ASIN ascending within each tab
+            return [(stage, idx) for stage in stages
+                    for idx in stage.sheet_df.sort_values('B00 ASIN').index if idx in stage.remaining]
+
+        work = []
+        for stage in stages:
+            values = self.row_values(stage.sheet_df)
+            work.extend((value, stage, idx) for idx, value in values.items() if idx in stage.remaining)
+        # Stable sort, so ties keep file/tab/row order
+        work.sort(key=lambda w: w[0], reverse=True)
+        return [(stage, idx) for _, stage, idx in work]
+
+    def process_row(self, stage: StagedTab, idx: Any):
+        row = stage.sheet_df.loc[idx]
+        asin = row['B00 ASIN']
+        logger.info(f"Fetching Keepa data for {asin} ({stage.tab})")
+
+        keepa_df = self.fetch_asin(stage.file_path, stage.tab, asin)
+
+        # Convert row to dict for merging
+        row_dict = row.to_dict()
+        if not keepa_df.empty:
+            keepa_data = keepa_df.iloc[0].to_dict()
+            row_dict.update(keepa_data)
+
+        stage.add(idx, row_dict)
+        self.manifest.data["current_input_file"] = str(stage.file_path)
+        self.manifest.data["current_tab"] = stage.tab
+        self.manifest.data["current_asin"] = asin
+
+    def checkpoint(self, stages: list[StagedTab]):
+        for stage in stages:
+            if stage.dirty:
+                stage.save()
+        self.manifest.update_progress(self.manifest.data["current_input_file"], self.manifest.data["current_tab"],
+                                      self.manifest.data["current_asin"])
+
+    def complete_stage(self, stage: StagedTab):
+        stage.save()
+        self.manifest.mark_tab_complete(str(stage.file_path), stage.tab)
+        logger.info(f"Tab {stage.tab} in {stage.file_path.name} complete.")
+
+    def _staging_csv(self, file_path: Path, tab: str) -> Path:
+        return self.staging_dir / f"{Path(file_path).name}_{tab}.csv"
+
+    def fetch_asin(self, file_path: Path, tab: str, asin: str, resolve: bool = True) -> pd.DataFrame:
+        # Queue failed lookups for the deferred retry pass; clear any stale entry on success unless
+        # the caller resolves it itself
+        keepa_df = self.keepa_client.get_asin_df(asin)
+        failure = self.keepa_client.last_failures.get(asin)
+        if not failure and keepa_df.empty:
+            failure = {'error': 'Keepa returned no data', 'error_kind': 'transient'}
+        if failure:
+            self.retry_queue.record_failure(str(file_path), tab, asin, failure['error'], failure['error_kind'])
+        elif resolve:
+            self.retry_queue.resolve(str(file_path), tab, asin)
+        return keepa_df
+
+    def retry_failed(self):
+        if not self.retry_queue.pending():
+            return
+        if not self.keepa_client.api:
+            # Leave entries pending so a later run with a key can retry them
+            logger.error(f"Keepa API not initialized; skipping retry of {len(self.retry_queue.pending())} ASINs.")
+            return
+        logger.info(f"Retrying {len(self.retry_queue.pending())} failed ASINs.")
+
+        while pending := self.retry_queue.pending():
+            entry = pending[0]
+            wait = entry["next_attempt_time"] - time.time()
+            if wait > 0:
+                logger.info(f"Waiting {wait:.0f}s before retrying {entry['asin']} (attempt {entry['attempts'] + 1})")
+                time.sleep(wait)
+
+            file_path, tab, asin = Path(entry["input_file"]), entry["tab"], entry["asin"]
+            keepa_df = self.fetch_asin(file_path, tab, asin, resolve=False)
+            if keepa_df.empty:
+                continue
+            # Only drop the entry once the data is actually in the staged row
+            if self.patch_staged_row(file_path, tab, asin, keepa_df.iloc[0].to_dict()):
+                self.retry_queue.resolve(str(file_path), tab, asin)
+            else:
+                self.retry_queue.dead_letter(str(file_path), tab, asin,
+                                             'Fetched from Keepa but no staged row to patch', 'patch_failed')
+
+        dead_letters = self.retry_queue.dead_letters()
+        for entry in dead_letters:
+            logger.warning(f"Unresolved ASIN {entry['asin']} in {entry['tab']} after {entry['attempts']} "
+                           f"attempts ({entry['error_kind']}): {entry['last_error']}")
+
+    def patch_staged_row(self, file_path: Path, tab: str, asin: str, keepa_data: dict) -> bool:
+        staging_csv = self._staging_csv(file_path, tab)
+        if not staging_csv.exists():
+            logger.warning(f"No staged data for {tab} in {file_path.name}; cannot patch {asin}.")
+            return False
+
+        df = pd.read_csv(staging_csv)
+        # The queue stores ASINs as strings; the CSV column may read back as numbers
+        mask = df['B00 ASIN'].astype(str) == str(asin)
+        if not mask.any():
+            logger.warning(f"{asin} not found in staged data for {tab}; nothing to patch.")
+            return False
+        for col, val in keepa_data.items():
+            # Column dtypes are inferred from the CSV and may not fit the fetched value
+            if col in df.columns and df[col].dtype != object:
+                df[col] = df[col].astype(object)
+            df.loc[mask, col] = val
+        df.to_csv(staging_csv, index=False)
+        logger.info(f"Patched staged row for {asin} in {tab}.")
+        return True
+
+    def _report_path(self, suffix: str) -> Path:
+        # Reports are named after the first input file
+        return self.output_dir / self.input_files[0].name.replace('.xlsx', f'_{suffix}.xlsx')
+
+    def _tabs_in_sheet_order(self, tabs: set[tuple[str, str]]) -> list[tuple[Path, str]]:
+        # Reports follow input file and workbook tab order, not the order tabs were enriched in
+        ordered = []
+        for file_path in self.input_files:
+            in_file = [tab for f, tab in tabs if f == str(file_path)]
+            order = self.sheet_order.get(str(file_path), [])
+            in_file.sort(key=lambda tab: order.index(tab) if tab in order else len(order))
+            ordered += [(file_path, tab) for tab in in_file]
+        return ordered
+
+    def _write_tab_sheets(self, writer: pd.ExcelWriter, tabs: list[tuple[Path, str]]):
+        for file_path, tab in tabs:
+            staging_csv = self._staging_csv(file_path, tab)
             if staging_csv.exists():
-                existing_df = pd.read_csv(staging_csv)
-                results = existing_df.to_dict('records')
-                last_asin = self.manifest.data.get("current_asin")
-                if last_asin:
-                    logger.info(f"Resuming {tab} from ASIN: {last_asin}")
-                    sheet_df = sheet_df[sheet_df['B00 ASIN'] >= last_asin]
-                    results = list(filter(lambda x: x['B00 ASIN'] < last_asin, results))
-                else:
-                    logger.info(f"Resuming {tab} from start (no ASIN in manifest)")
-        
-        if sheet_df.empty and results:
-            logger.info(f"Tab {tab} already finished processing all ASINs.")
-        else:
-            for i, (idx, row) in enumerate(sheet_df.iterrows()):
-                asin = row['B00 ASIN']
-                logger.info(f"Fetching Keepa data for {asin}")
-                
-                keepa_df = self.keepa_client.get_asin_df(asin)
-                
-                # Convert row to dict for merging
-                row_dict = row.to_dict()
-                if not keepa_df.empty:
-                    keepa_data = keepa_df.iloc[0].to_dict()
-                    row_dict.update(keepa_data)
-                
-                results.append(row_dict)
-                
-                # Periodic checkpoint
-                if len(results) % 10 == 0:
-                    pd.DataFrame(results).to_csv(staging_csv, index=False)
-                    self.manifest.update_progress(str(file_path), tab, asin)
-
-        # Final save for tab
-        if results:
-            final_df = pd.DataFrame(results)
-            final_df.to_csv(staging_csv, index=False)
-            # Update manifest with last ASIN in result set
-            last_asin = results[-1].get('B00 ASIN')
-            self.manifest.update_progress(str(file_path), tab, last_asin)
+                df = pd.read_csv(staging_csv)
+                # Rows are staged in enrichment order; report them by ASIN as before
+                sort_cols = ['B00 ASIN'] + (['source_row'] if 'source_row' in df.columns else [])
+                df = df.sort_values(sort_cols).drop(columns=['source_row'], errors='ignore')
+                df.to_excel(writer, sheet_name=f"{tab}_result", index=False)
+
+    def write_provisional_report(self, stages: list[StagedTab]):
+        self.checkpoint(stages)
+        self.last_provisional_time = time.time()
+
+        report_path = self._report_path('provisional')
+        temp_path = report_path.with_name(f"{report_path.stem}.tmp.xlsx")
+        tabs = {(file_path, tab) for file_path, completed in self.manifest.data["completed_tabs"].items()
+                for tab in completed}
+        tabs |= {(str(stage.file_path), stage.tab) for stage in stages if stage.records}
+        try:
+            with pd.ExcelWriter(temp_path, engine='openpyxl') as writer:
+                self._write_tab_sheets(writer, self._tabs_in_sheet_order(tabs))
+            temp_path.replace(report_path)
+            logger.info(f"Provisional report generated: {report_path}")
+        except Exception as e:
+            # The report may be open in Excel; try again at the next interval
+            logger.error(f"Failed to write provisional report: {e}")
 
     def finalize(self):
         logger.info("Finalizing: Stitching staged files into Excel report.")
@@ -161,20 +432,24 @@ class DealAnalyzer:
         if not self.input_files:
             return
 
-        # Determine the name for the final report based on the first input file
-        report_name = self.input_files[0].name.replace('.xlsx', '_result.xlsx')
-        report_path = self.output_dir / report_name
+        report_path = self._report_path('result')
+        tabs = {(file_path, tab) for file_path, completed in self.manifest.data["completed_tabs"].items()
+                for tab in completed}
         
         with pd.ExcelWriter(report_path, engine='openpyxl') as writer:
-            for file_path in self.input_files:
-                completed_tabs = self.manifest.data["completed_tabs"].get(str(file_path), [])
-                for tab in completed_tabs:
-                    staging_csv = self.staging_dir / f"{file_path.name}_{tab}.csv"
-                    if staging_csv.exists():
-                        df = pd.read_csv(staging_csv)
-                        df.to_excel(writer, sheet_name=f"{tab}_result", index=False)
+            self._write_tab_sheets(writer, self._tabs_in_sheet_order(tabs))
+
+            unresolved = self.retry_queue.dead_letters() + self.retry_queue.pending()
+            if unresolved:
+                unresolved_df = pd.DataFrame(unresolved)[['input_file', 'tab', 'asin', 'attempts',
+                                                          'error_kind', 'last_error']]
+                unresolved_df.to_excel(writer, sheet_name="unresolved_asins", index=False)
         
+        self._report_path('provisional').unlink(missing_ok=True)
+        self.manifest.data["unresolved_asins"] = len(unresolved)
         self.manifest.data["output_files"] = [str(report_path)]
         self.manifest.data["status"] = "completed"
         self.manifest.save()
         logger.info(f"Report generated: {report_path}")
+        if unresolved:
+            logger.warning(f"{len(unresolved)} ASINs remain unresolved; see the unresolved_asins sheet.")
@@ -15,6 +15,8 @@ logger = logging.getLogger(__name__)
 class KeepaAPI:
     CSV_MAP = {'AMAZON': 0,
                'NEW': 1}
+    # Error message fragments that indicate the ASIN itself is bad, so retrying is pointless.
+    INVALID_ASIN_MARKERS = ('invalid asin', 'not found', 'no product')
 
     def __init__(self, output_dir: str, log_name: str, domain: str = 'CA', cache_max_age_days: int = 7,
                  enable_cache: bool = True, config_enrichment_cols: dict = None, enrichment_col_prefix: str = 'keepa_'):
@@ -34,6 +36,8 @@ class KeepaAPI:
             self.cache_dir.mkdir(parents=True, exist_ok=True)
             
         self.api = keepa.Keepa(self.api_key) if self.api_key else None
+        # asin -> {'error': str, 'error_kind': 'transient' | 'invalid'} for the most recent fetch attempt
+        self.last_failures: dict[str, dict] = {}
 
     def _get_cache_path(self, asin: str) -> Path:
         today = datetime.datetime.now().strftime('%Y-%m-%d')
@@ -83,10 +87,12 @@ class KeepaAPI:
     def get_product_data(self, asins: list[str], stats: int = 30, history: bool = True) -> list[dict]:
         results = []
         for asin in asins:
+            self.last_failures.pop(asin, None)
             data = self._read_from_cache(asin)
             if data is None:
                 if not self.api:
                     logger.error(f"Keepa API not initialized, cannot fetch {asin}")
+                    self.last_failures[asin] = {'error': 'Keepa API not initialized', 'error_kind': 'transient'}
                     continue
                 try:
                     logger.info(f"Fetching {asin} from Keepa API...")
@@ -95,8 +101,13 @@ class KeepaAPI:
                     data = raw_response[0] if isinstance(raw_response, list) and raw_response else None
                     if data:
                         self._write_to_cache(asin, data)
+                    else:
+                        logger.error(f"Keepa returned no product for {asin}")
+                        self.last_failures[asin] = {'error': 'Keepa returned no product', 'error_kind': 'invalid'}
                 except Exception as e:
-                    logger.error(f"Failed to query Keepa for {asin}: {e}")
+                    error_kind = self.classify_error(e)
+                    logger.error(f"Failed to query Keepa for {asin} ({error_kind}): {e}")
+                    self.last_failures[asin] = {'error': str(e), 'error_kind': error_kind}
                     continue
             
             if data:
@@ -104,6 +115,14 @@ class KeepaAPI:
         
         return results
 
+    @classmethod
+    def classify_error(cls, error: Exception) -> str:
+        # Bad input is permanent; anything else (timeouts, token exhaustion, server errors) is worth retrying
+        message = str(error).lower()
+        if isinstance(error, ValueError) or any(marker in message for marker in cls.INVALID_ASIN_MARKERS):
+            return 'invalid'
+        return 'transient'
+
     def get_results_dataframe(self, product_data: list[dict]) -> pd.DataFrame:
         if not product_data:
             return pd.DataFrame()
@@ -48,11 +48,26 @@ def parse_args() -> argparse.Namespace:
                         help='Marketplace domain (e.g., CA, US)')
     parser.add_argument('--log_name', type=str, default=exec_params.get('log_name', 'deal_analyzer.log'),
                         help='Filename of generated log.')
+    parser.add_argument('--max_retries', type=int, default=exec_params.get('max_retries', 3),
+                        help='Number of deferred retries for ASINs whose Keepa lookup failed transiently')
+    parser.add_argument('--retry_base_delay', type=float, default=exec_params.get('retry_base_delay', 30),
+                        help='Initial retry backoff in seconds, doubled after each failed attempt')
+    parser.add_argument('--retry_max_delay', type=float, default=exec_params.get('retry_max_delay', 600),
+                        help='Upper bound on the retry backoff in seconds')
+    parser.add_argument('--priority_order', type=str, choices=['asin', 'value'],
+                        default=exec_params.get('priority_order', 'asin'),
+                        help='Enrichment order: asin (per tab, by ASIN) or value (across all tabs, highest value first)')
+    parser.add_argument('--provisional_report_minutes', type=float,
+                        default=exec_params.get('provisional_report_minutes', 0),
+                        help='Minutes between provisional reports built from staged data (0 disables)')
     
     # Input config overrides
     input_config = config.get('input_config', {})
     parser.add_argument('--tab_regex', type=str, default=input_config.get('tab_regex', '^Detail_\\d+'),
                         help='Regex for excel tabs to process')
+    parser.add_argument('--priority_value_cols', type=str, nargs='+',
+                        default=input_config.get('priority_value_cols', ['EXT MSRP', 'Quantity']),
+                        help='Columns multiplied together to rank rows when priority_order is value')
 
     return parser.parse_args()
 
@@ -0,0 +1,288 @@
+def test_retry_queue_backoff_and_dead_letter(tmp_path):
+    from src.deal_analyzer import RetryQueue
+
+    queue = RetryQueue(str(tmp_path), max_retries=2, base_delay=10, max_delay=15)
+
+    queue.record_failure('a.xlsx', 'Detail_1', 'B000000001', 'timeout', 'transient', now=0)
+    entry = queue.pending()[0]
+    assert entry['attempts'] == 1
+    assert entry['next_attempt_time'] == 10
+
+    # Backoff doubles but is capped at max_delay
+    queue.record_failure('a.xlsx', 'Detail_1', 'B000000001', 'timeout', 'transient', now=100)
+    assert queue.pending()[0]['next_attempt_time'] == 115
+
+    # Exceeding max_retries moves the entry to the dead-letter list
+    queue.record_failure('a.xlsx', 'Detail_1', 'B000000001', 'timeout', 'transient', now=200)
+    assert not queue.pending()
+    assert queue.dead_letters()[0]['attempts'] == 3
+
+
+def test_retry_queue_invalid_asin_not_retried(tmp_path):
+    from src.deal_analyzer import RetryQueue
+
+    queue = RetryQueue(str(tmp_path))
+    queue.record_failure('a.xlsx', 'Detail_1', 'BADASIN', 'no product', 'invalid', now=0)
+
+    assert not queue.pending()
+    assert [e['asin'] for e in queue.dead_letters()] == ['BADASIN']
+
+
+def test_retry_queue_persists_and_resolves(tmp_path):
+    from src.deal_analyzer import RetryQueue
+
+    queue = RetryQueue(str(tmp_path))
+    queue.record_failure('a.xlsx', 'Detail_1', 'B000000001', 'timeout', 'transient', now=0)
+
+    reloaded = RetryQueue(str(tmp_path))
+    assert reloaded.load()
+    assert len(reloaded.pending()) == 1
+
+    reloaded.resolve('a.xlsx', 'Detail_1', 'B000000001')
+    assert not reloaded.pending()
+    assert not reloaded.dead_letters()
+
+
+def test_retry_queue_numeric_asin_persists(tmp_path):
+    import numpy as np
+    from src.deal_analyzer import RetryQueue
+
+    # Excel reads ISBN-10 ASINs as numbers
+    queue = RetryQueue(str(tmp_path))
+    queue.record_failure('a.xlsx', 'Detail_1', np.int64(1593275846), 'timeout', 'transient', now=0)
+
+    reloaded = RetryQueue(str(tmp_path))
+    assert reloaded.load()
+    assert [e['asin'] for e in reloaded.pending()] == ['1593275846']
+    assert not (tmp_path / 'retry_queue.json.tmp').exists()
+
+
+def test_classify_error():
+    from src.keepa_client import KeepaAPI
+
+    assert KeepaAPI.classify_error(ValueError('Invalid ASIN B0')) == 'invalid'
+    assert KeepaAPI.classify_error(RuntimeError('Product not found')) == 'invalid'
+    assert KeepaAPI.classify_error(TimeoutError('Read timed out')) == 'transient'
+    assert KeepaAPI.classify_error(Exception('REQUEST_REJECTED')) == 'transient'
+
+
+class FakeKeepaClient:
+    """Stands in for KeepaAPI; `responses` maps ASIN -> list of outcomes, one per call.
+
+    ASINs without a queued outcome get `default` (an empty result if None).
+    """
+
+    def __init__(self, responses: dict, api=True, default: dict = None):
+        self.responses = responses
+        self.default = default or {}
+        self.api = api
+        self.calls = []
+        self.last_failures = {}
+
+    def get_asin_df(self, asin):
+        import pandas as pd
+
+        self.calls.append(asin)
+        self.last_failures.pop(asin, None)
+        outcome = self.responses[asin].pop(0) if self.responses.get(asin) else self.default
+        if isinstance(outcome, BaseException):
+            raise outcome
+        if 'error_kind' in outcome:
+            self.last_failures[asin] = outcome
+        if not outcome or 'error_kind' in outcome:
+            return pd.DataFrame()
+        return pd.DataFrame([{'asin': asin, **outcome}])
+
+
+def _make_analyzer(tmp_path, **overrides):
+    from src.deal_analyzer import DealAnalyzer
+
+    arg_dict = {'output_dir': str(tmp_path), 'tab_regex': 'Detail_\\d+', 'input_file_list': [],
+                'keepa_client': None, 'log_name': 'test.log'}
+    arg_dict.update(overrides)
+    return DealAnalyzer(arg_dict)
+
+
+def _stage_with_failed_row(analyzer, input_file):
+    import pandas as pd
+
+    # B2's lookup failed, so its Keepa columns are NaN and keepa_releaseDate reads back as float
+    pd.DataFrame({'B00 ASIN': ['B1', 'B2'], 'asin': ['B1', None], 'keepa_releaseDate': [20200101, None]}) \
+        .to_csv(analyzer._staging_csv(input_file, 'Detail_1'), index=False)
+    analyzer.manifest.mark_tab_complete(str(input_file), 'Detail_1')
+    analyzer.retry_queue.record_failure(str(input_file), 'Detail_1', 'B2', 'timeout', 'transient', now=0)
+
+
+def test_retry_failed_patches_staged_row(tmp_path):
+    import pandas as pd
+
+    input_file = tmp_path / 'a.xlsx'
+    client = FakeKeepaClient({'B2': [{'error': 'timeout', 'error_kind': 'transient'},
+                                     {'keepa_releaseDate': '20210315'}]})
+    analyzer = _make_analyzer(tmp_path, keepa_client=client, input_file_list=[str(input_file)],
+                              retry_base_delay=0)
+    _stage_with_failed_row(analyzer, input_file)
+
+    analyzer.retry_failed()
+    analyzer.finalize()
+
+    assert client.calls == ['B2', 'B2']
+    staged = pd.read_csv(analyzer._staging_csv(input_file, 'Detail_1'), dtype=str)
+    assert staged.set_index('B00 ASIN').loc['B2', 'keepa_releaseDate'] == '20210315'
+    assert not analyzer.retry_queue.entries
+    report = pd.ExcelFile(tmp_path / 'a_result.xlsx')
+    assert 'unresolved_asins' not in report.sheet_names
+    assert analyzer.manifest.data['unresolved_asins'] == 0
+
+
+def test_retry_failed_dead_letters_and_reports_unresolved(tmp_path):
+    import pandas as pd
+
+    input_file = tmp_path / 'a.xlsx'
+    # No recorded failure and no data must still count as an attempt
+    client = FakeKeepaClient({'B2': [{}, {}, {}]})
+    analyzer = _make_analyzer(tmp_path, keepa_client=client, input_file_list=[str(input_file)],
+                              max_retries=2, retry_base_delay=0)
+    _stage_with_failed_row(analyzer, input_file)
+
+    analyzer.retry_failed()
+    analyzer.finalize()
+
+    assert client.calls == ['B2', 'B2']
+    unresolved = pd.read_excel(tmp_path / 'a_result.xlsx', sheet_name='unresolved_asins')
+    assert unresolved['asin'].tolist() == ['B2']
+    assert analyzer.manifest.data['unresolved_asins'] == 1
+
+
+def test_retry_failed_patches_numeric_asin_after_reload(tmp_path):
+    import numpy as np
+    import pandas as pd
+
+    input_file = tmp_path / 'a.xlsx'
+    staging_csv = tmp_path / 'staging' / 'a.xlsx_Detail_1.csv'
+    first = _make_analyzer(tmp_path, input_file_list=[str(input_file)])
+    pd.DataFrame({'B00 ASIN': [1593275846], 'keepa_title': [None]}).to_csv(staging_csv, index=False)
+    first.manifest.mark_tab_complete(str(input_file), 'Detail_1')
+    first.retry_queue.record_failure(str(input_file), 'Detail_1', np.int64(1593275846), 'timeout', 'transient',
+                                     now=0)
+
+    # Resumed run: the queue ASIN is now a string, the staged column reads back as int
+    client = FakeKeepaClient({'1593275846': [{'keepa_title': 'found'}]})
+    analyzer = _make_analyzer(tmp_path, keepa_client=client, input_file_list=[str(input_file)])
+    analyzer.retry_failed()
+
+    assert pd.read_csv(staging_csv)['keepa_title'].tolist() == ['found']
+    assert not analyzer.retry_queue.entries
+
+
+def test_retry_failed_dead_letters_unpatchable_row(tmp_path):
+    import pandas as pd
+
+    input_file = tmp_path / 'a.xlsx'
+    client = FakeKeepaClient({'B2': [{'keepa_releaseDate': '20210315'}], 'B9': [{'keepa_title': 'found'}]})
+    analyzer = _make_analyzer(tmp_path, keepa_client=client, input_file_list=[str(input_file)],
+                              retry_base_delay=0)
+    _stage_with_failed_row(analyzer, input_file)
+    # B9 has no staged row to patch once fetched
+    analyzer.retry_queue.record_failure(str(input_file), 'Detail_1', 'B9', 'timeout', 'transient', now=0)
+
+    analyzer.retry_failed()
+    analyzer.finalize()
+
+    assert [e['asin'] for e in analyzer.retry_queue.dead_letters()] == ['B9']
+    assert analyzer.retry_queue.dead_letters()[0]['error_kind'] == 'patch_failed'
+    unresolved = pd.read_excel(tmp_path / 'a_result.xlsx', sheet_name='unresolved_asins')
+    assert unresolved['asin'].tolist() == ['B9']
+    assert analyzer.manifest.data['unresolved_asins'] == 1
+
+
+def test_retry_failed_without_api_leaves_entries_pending(tmp_path):
+    input_file = tmp_path / 'a.xlsx'
+    client = FakeKeepaClient({}, api=None)
+    analyzer = _make_analyzer(tmp_path, keepa_client=client, input_file_list=[str(input_file)],
+                              retry_base_delay=0)
+    _stage_with_failed_row(analyzer, input_file)
+
+    analyzer.retry_failed()
+
+    assert client.calls == []
+    assert [e['asin'] for e in analyzer.retry_queue.pending()] == ['B2']
+
+
+def test_staged_tab_resumes_by_source_row(tmp_path):
+    import pandas as pd
+    from src.deal_analyzer import StagedTab
+
+    sheet_df = pd.DataFrame({'B00 ASIN': ['B3', 'B1', 'B2'], 'EXT MSRP': [5, 50, 20]})
+    staging_csv = tmp_path / 'a.xlsx_Detail_1.csv'
+
+    stage = StagedTab(tmp_path / 'a.xlsx', 'Detail_1', sheet_df, staging_csv)
+    # Processed out of ASIN order
+    stage.add(1, sheet_df.loc[1].to_dict())
+    stage.add(2, sheet_df.loc[2].to_dict())
+    stage.save()
+
+    resumed = StagedTab(tmp_path / 'a.xlsx', 'Detail_1', sheet_df, staging_csv)
+    assert resumed.remaining == {0}
+    assert len(resumed.records) == 2
+    assert not resumed.complete
+
+
+def test_prioritize_by_value_across_tabs(tmp_path):
+    import pandas as pd
+    from src.deal_analyzer import StagedTab
+
+    analyzer = _make_analyzer(tmp_path, priority_order='value')
+    tab_1 = StagedTab(tmp_path / 'a.xlsx', 'Detail_1',
+                      pd.DataFrame({'B00 ASIN': ['B1', 'B2'], 'EXT MSRP': [10, 100], 'Quantity': [1, 2]}),
+                      tmp_path / 'a.xlsx_Detail_1.csv')
+    tab_2 = StagedTab(tmp_path / 'a.xlsx', 'Detail_2',
+                      pd.DataFrame({'B00 ASIN': ['B3'], 'EXT MSRP': [60], 'Quantity': [3]}),
+                      tmp_path / 'a.xlsx_Detail_2.csv')
+
+    work = analyzer.prioritize([tab_1, tab_2])
+    assert [(stage.tab, idx) for stage, idx in work] == [('Detail_1', 1), ('Detail_2', 0), ('Detail_1', 0)]
+
+
+def test_run_by_value_resumes_after_interruption(tmp_path):
+    from collections import Counter
+
+    import pandas as pd
+    import pytest
+
+    input_file = tmp_path / 'a.xlsx'
+    with pd.ExcelWriter(input_file, engine='openpyxl') as writer:
+        pd.DataFrame({'B00 ASIN': ['A1', 'A2', 'A3', 'A4', 'A5', 'A6'], 'EXT MSRP': [10, 120, 30, 100, 50, 80],
+                      'Quantity': 1}).to_excel(writer, sheet_name='Detail_1', index=False)
+        pd.DataFrame({'B00 ASIN': ['B1', 'B2', 'B3', 'B4', 'B5', 'B6'], 'EXT MSRP': [110, 20, 90, 40, 70, 60],
+                      'Quantity': 1}).to_excel(writer, sheet_name='Detail_2', index=False)
+
+    # Killed while fetching the 11th row, after the checkpoint at row 10
+    client = FakeKeepaClient({'B2': [KeyboardInterrupt()]}, default={'keepa_title': 'found'})
+    arg_overrides = dict(keepa_client=client, input_file_list=[str(input_file)], priority_order='value',
+                         provisional_report_minutes=1e-9)
+
+    with pytest.raises(KeyboardInterrupt):
+        _make_analyzer(tmp_path / 'out', **arg_overrides).run()
+
+    assert client.calls == ['A2', 'B1', 'A4', 'B3', 'A6', 'B5', 'B6', 'A5', 'B4', 'A3', 'B2']
+    provisional = pd.read_excel(tmp_path / 'out' / 'a_provisional.xlsx', sheet_name=None)
+    assert list(provisional) == ['Detail_1_result', 'Detail_2_result']
+    assert provisional['Detail_1_result']['B00 ASIN'].tolist() == ['A2', 'A3', 'A4', 'A5', 'A6']
+    assert 'source_row' not in provisional['Detail_1_result'].columns
+    assert not (tmp_path / 'out' / 'a_provisional.tmp.xlsx').exists()
+
+    _make_analyzer(tmp_path / 'out', **arg_overrides).run()
+
+    counts = Counter(client.calls)
+    assert counts.pop('B2') == 2  # interrupted call plus its retry on resume
+    assert set(counts.values()) == {1}
+    assert len(counts) == 11
+
+    report = pd.read_excel(tmp_path / 'out' / 'a_result.xlsx', sheet_name=None)
+    assert list(report) == ['Detail_1_result', 'Detail_2_result']
+    assert report['Detail_1_result']['B00 ASIN'].tolist() == ['A1', 'A2', 'A3', 'A4', 'A5', 'A6']
+    assert report['Detail_2_result']['B00 ASIN'].tolist() == ['B1', 'B2', 'B3', 'B4', 'B5', 'B6']
+    assert (report['Detail_2_result']['keepa_title'] == 'found').all()
+    assert 'source_row' not in report['Detail_2_result'].columns
+    assert not (tmp_path / 'out' / 'a_provisional.xlsx').exists()